@@ -8,9 +8,10 @@ from fastapi import FastAPI, Request, Response
 from fastapi.responses import StreamingResponse, RedirectResponse
 from contextlib import asynccontextmanager
 from starlette.background import BackgroundTask
+from starlette.requests import ClientDisconnect
 import httpx
 import traceback
-import json
+import orjson
 import os
 import time
 import asyncio
@@ -23,12 +24,16 @@ from .config import (
     PORT,
     ENABLE_DASHBOARD,
     DASHBOARD_API_KEY,
-    CUSTOM_HEADERS
+    CUSTOM_HEADERS,
+    LOG_REQUESTS,
+    LOG_BODIES,
+    LOG_DYNAMIC_TARGET,
+    env_flag,
 )
 
 # 导入统计服务
 from .services.stats import (
-    record_request_start,
+    emit_request_start,
     record_request_success,
     record_request_error,
     periodic_stats_update,
@@ -43,7 +48,7 @@ from .services.proxy import (
 )
 
 # 导入编码工具
-from .utils.encoding import ensure_unicode
+from .utils.encoding import ensure_unicode, decompress_body
 
 # 导入 Admin 路由
 from .routers.admin import router as admin_router
@@ -51,6 +56,21 @@ from .routers.admin import router as admin_router
 # Shared HTTP client for connection pooling and proper lifecycle management
 http_client: httpx.AsyncClient = None  # type: ignore
 
+# 响应完成后的收尾任务队列（关闭上游响应 + 记录统计），由单个常驻 worker 批量处理
+completion_queue: asyncio.Queue | None = None
+
+# worker 每批最多处理的收尾任务数
+COMPLETION_BATCH_SIZE = 64
+
+# 关闭时等待队列中剩余收尾任务完成的最长时间（秒）
+COMPLETION_DRAIN_TIMEOUT = 10.0
+
+# 浏览器/爬虫的常见探测路径，直接返回 404，不转发到上游
+_STATIC_404_PATHS = frozenset({"favicon.ico", "robots.txt", "sitemap.xml"})
+
+# 不计入统计的 Dashboard 路径前缀
+_DASHBOARD_PATH_PREFIXES = ("api/admin", "admin")
+
 
 def _format_httpx_request_error(e: Exception) -> str:
     parts = [f"{type(e).__name__}: {repr(e)}"]
@@ -65,21 +85,58 @@ def _safe_error_detail_for_response(e: Exception) -> str:
     detail = _format_httpx_request_error(e)
     return detail[:800]
 
+
+def _declared_body_size(request: Request) -> int | None:
+    """读取客户端声明的 Content-Length，缺失或非法时返回 None"""
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        return None
+    try:
+        return int(content_length)
+    except ValueError:
+        return None
+
+
+def _has_request_body(request: Request) -> bool:
+    """判断请求是否携带请求体（Content-Length > 0 或分块传输）"""
+    if "transfer-encoding" in request.headers:
+        return True
+    return bool(_declared_body_size(request))
+
+
 logger = logging.getLogger('claude_proxy')
 
-def _env_flag(name: str, default: str = 'false') -> bool:
-    return os.getenv(name, default).lower() in ('true', '1', 'yes', 'y', 'on')
 
-# 默认尽量安静：只在 WARNING/ERROR 时输出；需要时可通过环境变量打开
-LOG_REQUESTS = _env_flag('CLAUDE_PROXY_LOG_REQUESTS', 'false')
-LOG_BODIES = _env_flag('CLAUDE_PROXY_LOG_BODIES', 'false')
-LOG_DYNAMIC_TARGET = _env_flag('CLAUDE_PROXY_LOG_DYNAMIC_TARGET', 'false')
+async def _completion_worker(queue: asyncio.Queue):
+    """常驻 worker：批量取出收尾任务并并发执行，避免每个请求各自在响应路径上等待"""
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < COMPLETION_BATCH_SIZE:
+            try:
+                batch.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+        results = await asyncio.gather(*(job() for job in batch), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("[Proxy] Failed to finalize response: %s", result)
+        for _ in batch:
+            queue.task_done()
+
+
+async def _enqueue_completion(job):
+    """将收尾任务交给 worker；worker 未启动时（如未经过 lifespan）直接执行"""
+    if completion_queue is None:
+        await job()
+    else:
+        completion_queue.put_nowait(job)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
     """Manage application lifespan events"""
-    global http_client
+    global http_client, completion_queue
 
     # 初始化日志系统：默认 WARNING，DEBUG_MODE 时切到 DEBUG，也允许 LOG_LEVEL 覆盖
     env_level = os.getenv('LOG_LEVEL')
@@ -100,6 +157,11 @@ async def lifespan(_: FastAPI):
     # 启动超时请求清理任务
     cleanup_task = asyncio.create_task(cleanup_stale_requests())
 
+    # 启动响应收尾 worker
+    queue: asyncio.Queue = asyncio.Queue()
+    completion_queue = queue
+    completion_task = asyncio.create_task(_completion_worker(queue))
+
     # 输出应用配置信息（只在 worker 进程启动时输出一次）
     logger.info('=' * 60)
     logger.info('Application Configuration:')
@@ -110,6 +172,7 @@ async def lifespan(_: FastAPI):
         logger.info('  Custom Headers Keys: %s', list(CUSTOM_HEADERS.keys()))
     logger.info('  Debug Mode: %s', DEBUG_MODE)
     logger.info('  Hot Reload: %s', DEBUG_MODE)
+    logger.info('  Event Loop: %s', type(asyncio.get_running_loop()).__module__.split('.')[0])
     logger.info('  Dashboard Enabled: %s', ENABLE_DASHBOARD)
     if ENABLE_DASHBOARD:
         logger.info('  Dashboard API Key Configured: %s', 'Yes' if DASHBOARD_API_KEY else 'No')
@@ -138,6 +201,16 @@ async def lifespan(_: FastAPI):
         transport_retries = int(os.getenv("CC_SWITCH_HTTPX_TRANSPORT_RETRIES", "1"))
     except Exception:
         transport_retries = 1
+    try:
+        connect_timeout = float(os.getenv("CC_SWITCH_HTTPX_CONNECT_TIMEOUT", "10.0"))
+    except Exception:
+        connect_timeout = 10.0
+
+    # HTTP/2：在单个 TCP+TLS 连接上多路复用并发请求，省去新连接的握手开销（需上游支持，依赖 h2）
+    # 默认关闭以保持原有行为；启用时建议同时调大 CC_SWITCH_HTTPX_MAX_KEEPALIVE，让连接能被复用
+    http2 = env_flag("CC_SWITCH_HTTPX_HTTP2", "false")
+
+    timeout = httpx.Timeout(60.0, connect=connect_timeout)
 
     limits = httpx.Limits(
         max_connections=max_connections,
@@ -153,7 +226,7 @@ async def lifespan(_: FastAPI):
         if "://" not in http_proxy:
             http_proxy = f"http://{http_proxy}"
         mounts["http://"] = httpx.AsyncHTTPTransport(
-            proxy=http_proxy, retries=transport_retries, limits=limits, http2=False
+            proxy=http_proxy, retries=transport_retries, limits=limits, http2=http2
         )
         logger.info("HTTP Proxy configured: %s", http_proxy)
 
@@ -162,7 +235,7 @@ async def lifespan(_: FastAPI):
         if "://" not in https_proxy:
             https_proxy = f"http://{https_proxy}"
         mounts["https://"] = httpx.AsyncHTTPTransport(
-            proxy=https_proxy, retries=transport_retries, limits=limits, http2=False
+            proxy=https_proxy, retries=transport_retries, limits=limits, http2=http2
         )
         logger.info("HTTPS Proxy configured: %s", https_proxy)
 
@@ -171,19 +244,20 @@ async def lifespan(_: FastAPI):
         if mounts:
             http_client = httpx.AsyncClient(
                 follow_redirects=False,
-                timeout=60.0,
+                timeout=timeout,
                 mounts=mounts
             )
             logger.info("HTTP client initialized with proxy mounts: %s", list(mounts.keys()))
         else:
             http_client = httpx.AsyncClient(
                 follow_redirects=False,
-                timeout=60.0,
+                timeout=timeout,
                 transport=httpx.AsyncHTTPTransport(
-                    retries=transport_retries, limits=limits, http2=False
+                    retries=transport_retries, limits=limits, http2=http2
                 ),
             )
             logger.info("HTTP client initialized without proxy")
+        logger.info("HTTP/2 enabled: %s", http2)
     except Exception as e:
         logger.exception("Failed to initialize HTTP client: %s", e)
         raise
@@ -196,6 +270,15 @@ async def lifespan(_: FastAPI):
     stats_task.cancel()
     cleanup_task.cancel()
 
+    # 先停止入队（之后的收尾任务直接执行），再等待队列中剩余任务完成，
+    # 确保统计已记录、上游响应已关闭后才取消 worker 并关闭 http_client
+    completion_queue = None
+    try:
+        await asyncio.wait_for(queue.join(), COMPLETION_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("[Proxy] Response finalizers not drained within %ss, cancelling", COMPLETION_DRAIN_TIMEOUT)
+    completion_task.cancel()
+
     try:
         await stats_task
     except asyncio.CancelledError:
@@ -206,6 +289,11 @@ async def lifespan(_: FastAPI):
     except asyncio.CancelledError:
         pass
 
+    try:
+        await completion_task
+    except asyncio.CancelledError:
+        pass
+
     await http_client.aclose()
 
 
@@ -251,13 +339,28 @@ async def root_redirect(request: Request):
 
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
 async def proxy(path: str, request: Request):
+    # 噪声请求直接返回，避免读取请求体和访问上游
+    if path in _STATIC_404_PATHS:
+        return Response(status_code=404)
+
     # 记录请求开始
     start_time = time.time()
-    body = await request.body()
+
+    # /v1/messages 需要修改 JSON，必须完整读取请求体；
+    # 其余路由不检查请求体，有请求体时直接流式转发给上游，避免整体缓冲
+    is_messages = path == "v1/messages" or path == "v1/messages/"
+    body: bytes | None
+    body_size: int | None
+    if is_messages or not _has_request_body(request):
+        body = await request.body()
+        body_size = len(body)
+    else:
+        body = None
+        body_size = _declared_body_size(request)
 
     # 跳过 Dashboard 相关路径的统计
-    if not path.startswith("api/admin") and not path.startswith("admin"):
-        request_id = await record_request_start(path, request.method, len(body))
+    if not path.startswith(_DASHBOARD_PATH_PREFIXES):
+        request_id = emit_request_start(path, request.method, body_size)
     else:
         request_id = None
 
@@ -279,41 +382,49 @@ async def proxy(path: str, request: Request):
         target_url += f"?{query}"
 
     if LOG_REQUESTS:
-        logger.info("[Proxy] Request: %s %s -> %s (body=%s bytes)", request.method, path, base_url, len(body))
-    if LOG_BODIES and (DEBUG_MODE or LOG_REQUESTS):
+        logger.info("[Proxy] Request: %s %s -> %s (body=%s bytes)", request.method, path, base_url, body_size)
+    if LOG_BODIES and body is not None and (DEBUG_MODE or LOG_REQUESTS) and logger.isEnabledFor(logging.DEBUG):
         try:
-            data = json.loads(body.decode('utf-8'))
-            logger.debug("[Proxy] Original body (%s bytes): %s", len(body), json.dumps(data, ensure_ascii=False)[:4000])
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            data = orjson.loads(body)
+            logger.debug("[Proxy] Original body (%s bytes): %s", len(body), orjson.dumps(data).decode('utf-8')[:4000])
+        except (orjson.JSONDecodeError, ValueError) as e:
             logger.debug("[Proxy] Failed to parse JSON: %s", e)
 
     # 处理请求体（替换 system prompt）
     # 仅在路由为 /v1/messages 时执行处理
     if LOG_REQUESTS:
         logger.debug("[Proxy] Processing request for path: %s", path)
-    if path == "v1/messages" or path == "v1/messages/":
+    if is_messages and body is not None:
         body = process_request_body(body)
 
-    # 准备转发的请求头
-    incoming_headers = list(request.headers.items())
+    # 准备转发的请求头（直接传入 request.headers，避免额外构造列表）
     client_host = request.client.host if request.client else None
 
     # 读取动态 API Key（用于 cc-switch 集成）
     dynamic_api_key = request.headers.get("X-API-Key")
 
-    forward_headers = prepare_forward_headers(incoming_headers, client_host, base_url, dynamic_api_key)
+    forward_headers = prepare_forward_headers(request.headers, client_host, base_url, dynamic_api_key)
+
+    # 流式转发且长度已知时保留 Content-Length，避免上游收到分块传输
+    if body is None and body_size is not None:
+        forward_headers["Content-Length"] = str(body_size)
+
+    # 响应体原样透传（不解压），客户端未声明 Accept-Encoding 时要求上游不压缩，
+    # 避免 httpx 默认的 Accept-Encoding 让上游返回客户端无法处理的压缩内容
+    if "accept-encoding" not in request.headers:
+        forward_headers["Accept-Encoding"] = "identity"
 
     # 发起上游请求并流式处理响应
     response_time = 0
     bytes_received = 0
-    error_response_content = b""  # 新增：缓存错误响应内容（仅当状态码 >= 400 时）
+    error_response_content = bytearray()  # 新增：缓存错误响应内容（仅当状态码 >= 400 时）
     try:
         # 构建请求但不使用 context manager
         req = http_client.build_request(
             method=request.method,
             url=target_url,
             headers=forward_headers,
-            content=body,
+            content=body if body is not None else request.stream(),
         )
 
         # 发送请求并开启流式模式 (不使用 async with)
@@ -328,20 +439,25 @@ async def proxy(path: str, request: Request):
         # 异步生成器:流式读取响应内容并统计字节数
         async def iter_response():
             nonlocal bytes_received
-            nonlocal error_response_content
+            # 如果是错误响应，缓存原始内容（限制 50KB，可能是压缩数据）；达到上限后不再检查
+            capture_errors = resp.status_code >= 400
             try:
-                async for chunk in resp.aiter_bytes():
+                # 使用 aiter_raw 原样透传上游字节，跳过 httpx 的解压，Content-Encoding 由客户端处理
+                async for chunk in resp.aiter_raw():
                     bytes_received += len(chunk)
-                    # 如果是错误响应，缓存内容（限制 50KB）
-                    if resp.status_code >= 400 and len(error_response_content) < 50*1024:
-                        error_response_content += chunk
+                    if capture_errors:
+                        remaining = 50*1024 - len(error_response_content)
+                        if remaining > 0:
+                            error_response_content.extend(chunk[:remaining])
+                        else:
+                            capture_errors = False
                     yield chunk
             except Exception as e:
                 # 优雅处理客户端断开连接
                 logger.debug("[Stream Error] %s", e)
                 # 静默处理,避免日志污染
             finally:
-                # 确保资源被释放 (作为备份,主要由 BackgroundTask 处理)
+                # 确保资源被释放 (作为备份,主要由收尾 worker 处理)
                 pass
 
         # 创建响应完成后的统计任务
@@ -358,21 +474,33 @@ async def proxy(path: str, request: Request):
                         resp.status_code
                     )
                 else:
-                    # 使用缓存的响应内容
-                    response_content = ensure_unicode(error_response_content) if error_response_content else None
-                    err_content_len = len(error_response_content)
-                    short = None
-                    if response_content:
-                        short = response_content[:200] + ("..." if len(response_content) > 200 else "")
-                    logger.warning(
-                        "[Proxy] Upstream error: %s %s -> %s status=%s resp_bytes=%s resp=%s",
-                        request.method,
-                        path,
-                        base_url,
-                        resp.status_code,
-                        err_content_len,
-                        short,
-                    )
+                    # 使用缓存的响应内容（按 Content-Encoding 解压后再转文本）
+                    response_content = None
+                    if error_response_content:
+                        # 解压输出同样限制在 50KB 以内，避免高压缩比的响应体膨胀占满内存
+                        raw_content = decompress_body(
+                            bytes(error_response_content), resp.headers.get("content-encoding"), max_length=50*1024
+                        )
+                        # 上游错误响应几乎总是合法 UTF-8：先直接解码，失败时再走通用处理
+                        try:
+                            response_content = raw_content.decode('utf-8')
+                        except UnicodeDecodeError:
+                            response_content = ensure_unicode(raw_content)
+                    # 仅在 WARNING 级别启用时才构造日志摘要
+                    if logger.isEnabledFor(logging.WARNING):
+                        err_content_len = len(error_response_content)
+                        short = None
+                        if response_content:
+                            short = response_content[:200] + ("..." if len(response_content) > 200 else "")
+                        logger.warning(
+                            "[Proxy] Upstream error: %s %s -> %s status=%s resp_bytes=%s resp=%s",
+                            request.method,
+                            path,
+                            base_url,
+                            resp.status_code,
+                            err_content_len,
+                            short,
+                        )
 
                     # 记录错误到统计服务
                     await record_request_error(
@@ -385,14 +513,29 @@ async def proxy(path: str, request: Request):
                         resp.status_code
                     )
 
-        # 使用 BackgroundTask 在响应完成后关闭连接和记录统计
+        # 响应完成后将关闭连接和记录统计交给收尾 worker
         return StreamingResponse(
             iter_response(),
             status_code=resp.status_code,
             headers=response_headers,
-            background=BackgroundTask(close_and_record),
+            background=BackgroundTask(_enqueue_completion, close_and_record),
         )
 
+    except ClientDisconnect:
+        # 流式上传过程中客户端断开：请求体不完整，无法也无需再转发
+        if request_id:
+            await record_request_error(
+                request_id,
+                path,
+                request.method,
+                "client disconnected",
+                time.time() - start_time,
+                None,
+                499
+            )
+        logger.info("[Proxy] Client disconnected during upload: %s %s", request.method, path)
+        return Response(status_code=499)
+
     except httpx.RequestError as e:
         # 记录请求错误
         detail = _safe_error_detail_for_response(e)
@@ -418,7 +561,16 @@ async def proxy(path: str, request: Request):
 
 
 if __name__ == "__main__":
+    from typing import Literal, cast
+
     import uvicorn
     # 开发模式启用热重载，生产模式禁用（通过 DEBUG_MODE 环境变量控制）
     # 注意：使用模块路径而非文件路径，以支持相对导入
-    uvicorn.run("backend.app:app", host="0.0.0.0", port=PORT, reload=DEBUG_MODE)
+    # 事件循环：uvicorn[standard] 自带 uvloop，auto 会优先使用 uvloop（基于 libuv 的 C 实现），
+    # 不可用时回退到 asyncio；可通过 CC_SWITCH_EVENT_LOOP=uvloop/asyncio 显式指定
+    loop_name = os.getenv("CC_SWITCH_EVENT_LOOP", "auto").strip().lower()
+    if loop_name not in ("auto", "asyncio", "uvloop"):
+        logger.warning("[Proxy] Unknown CC_SWITCH_EVENT_LOOP=%r, falling back to auto", loop_name)
+        loop_name = "auto"
+    loop_impl = cast(Literal["auto", "asyncio", "uvloop"], loop_name)
+    uvicorn.run("backend.app:app", host="0.0.0.0", port=PORT, reload=DEBUG_MODE, loop=loop_impl)
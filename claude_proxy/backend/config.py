@@ -15,6 +15,12 @@ logger = logging.getLogger('claude_proxy')
 # 加载环境变量
 load_dotenv()
 
+
+def env_flag(name: str, default: str = 'false') -> bool:
+    """读取布尔型环境变量（true/1/yes/y/on 视为开启）"""
+    return os.getenv(name, default).lower() in ('true', '1', 'yes', 'y', 'on')
+
+
 # ===== 基础配置 =====
 # 主站：https://anyrouter.top
 TARGET_BASE_URL = os.getenv("API_BASE_URL", "https://anyrouter.top")
@@ -38,6 +44,14 @@ CLAUDE_CODE_KEYWORD = "Claude Code"
 # 调试模式配置
 DEBUG_MODE = os.getenv("DEBUG_MODE", "false").lower() in ("true", "1", "yes")
 
+# 日志开关配置
+# 默认尽量安静：只在 WARNING/ERROR 时输出；需要时可通过环境变量打开
+LOG_REQUESTS = env_flag('CLAUDE_PROXY_LOG_REQUESTS', 'false')
+LOG_BODIES = env_flag('CLAUDE_PROXY_LOG_BODIES', 'false')
+LOG_DYNAMIC_TARGET = env_flag('CLAUDE_PROXY_LOG_DYNAMIC_TARGET', 'false')
+# 仅在需要时输出 System Replacement 细节，避免污染 claude_proxy.log
+LOG_SYSTEM_REPLACEMENT = env_flag('CLAUDE_PROXY_LOG_SYSTEM_REPLACEMENT', 'false') or DEBUG_MODE
+
 # 服务端口配置
 PORT = int(os.getenv("PORT", "8088"))
 
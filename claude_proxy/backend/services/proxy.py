@@ -4,12 +4,16 @@
 负责处理 HTTP 请求和响应，包括请求头过滤、请求体处理和 System Prompt 替换
 """
 
+import functools
 import json
 import logging
-import os
-from typing import Iterable
+import re
+from typing import Iterable, Mapping
 from urllib.parse import urlparse
 
+import orjson
+from starlette.datastructures import Headers
+
 from ..config import (
     HOP_BY_HOP_HEADERS,
     PRESERVE_HOST,
@@ -18,69 +22,202 @@ from ..config import (
     CLAUDE_CODE_KEYWORD,
     CUSTOM_HEADERS,
     TARGET_BASE_URL,
-    DEBUG_MODE,
+    LOG_SYSTEM_REPLACEMENT,
 )
 
 logger = logging.getLogger('claude_proxy')
 
-def _env_flag(name: str, default: str = 'false') -> bool:
-    return os.getenv(name, default).lower() in ('true', '1', 'yes', 'y', 'on')
+# 预编译关键字匹配（忽略大小写），避免每次请求都对整段 system prompt 做 lower() 拷贝
+_CLAUDE_CODE_KEYWORD_RE = re.compile(re.escape(CLAUDE_CODE_KEYWORD), re.IGNORECASE)
+
+# 请求头排除集合（小写）：
+# - hop-by-hop 头部
+# - Content-Length：我们可能会修改请求体，让 httpx 根据实际内容自动计算
+# - Host：未启用 PRESERVE_HOST 时由 prepare_forward_headers 重新设置
+_REQ_EXCLUDE = frozenset(HOP_BY_HOP_HEADERS) | {"content-length"} | (frozenset() if PRESERVE_HOST else {"host"})
+
+# 响应头排除集合（小写）：
+# - hop-by-hop 头部
+# - Content-Length：避免流式响应时长度不匹配，StreamingResponse 会自动处理传输编码
+# Content-Encoding 保留：响应体通过 aiter_raw 原样透传（不解压），由客户端自行解压
+_RESP_EXCLUDE = frozenset(HOP_BY_HOP_HEADERS) | {"content-length"}
+
+# 默认目标的 netloc 在启动时解析一次
+_TARGET_NETLOC = urlparse(TARGET_BASE_URL).netloc
+
+
+@functools.lru_cache(maxsize=256)
+def _netloc_for(url: str) -> str:
+    """解析 URL 的 netloc（动态目标通常只有少数几个，缓存结果避免重复解析）"""
+    return urlparse(url).netloc
 
-# 仅在需要时输出 System Replacement 细节，避免污染 claude_proxy.log
-LOG_SYSTEM_REPLACEMENT = _env_flag('CLAUDE_PROXY_LOG_SYSTEM_REPLACEMENT', 'false') or DEBUG_MODE
 
+# 原地替换 system[0].text 所用的正则（均作用于原始 bytes）
+_SYSTEM_ARRAY_RE = re.compile(rb'"system"\s*:\s*\[\s*\{')
+_OBJECT_KEY_RE = re.compile(rb'\s*("[^"\\]*(?:\\.[^"\\]*)*")\s*:\s*')
+_JSON_STRING_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"')
+# 简单值：数字/true/false/null，或不含嵌套的对象（如 cache_control）
+_FLAT_VALUE_RE = re.compile(rb'\{[^{}\[\]"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^{}\[\]"]*)*\}|[-+.\w]+')
+_OBJECT_SEP_RE = re.compile(rb'\s*([,}])')
+# 转义的 ASCII 小写字母（\u0060-\u007f）：含转义的键（如 "\u0073ystem"）解码后可能与 system 重名；
+# 常见序列化器不会转义 ASCII 字母，出现时直接回退到完整解析，无需逐个检查请求体中的键
+_ESCAPED_LOWERCASE_RE = re.compile(rb'\\u00[67]')
 
-def filter_request_headers(headers: Iterable[tuple]) -> dict:
+# 替换文本的 JSON 字符串字面量（含引号），启动时编码一次
+_REPLACEMENT_JSON = orjson.dumps(SYSTEM_PROMPT_REPLACEMENT) if SYSTEM_PROMPT_REPLACEMENT is not None else None
+
+
+@functools.lru_cache(maxsize=1024)
+def _auth_header_for(api_key: str) -> tuple[str, str]:
+    """
+    根据 API Key 格式决定注入的认证头部
+
+    - Bearer Token 使用 authorization
+    - Anthropic API Key（sk-ant-）及其他格式默认使用 x-api-key
+    """
+    if api_key.startswith("Bearer "):
+        return "authorization", api_key
+    return "x-api-key", api_key
+
+
+def filter_request_headers(
+    headers: Headers | Mapping[str, str] | Iterable[tuple[str, str]],
+) -> dict[str, str]:
     """
     过滤请求头，移除 hop-by-hop 头部和 Content-Length
 
     Args:
-        headers: 原始请求头（可迭代的元组列表）
+        headers: 原始请求头（Starlette Headers、普通映射，或可迭代的 (key, value) 元组）
 
     Returns:
         dict: 过滤后的请求头字典
     """
-    out = {}
-    for k, v in headers:
-        lk = k.lower()
-        if lk in HOP_BY_HOP_HEADERS:
-            continue
-        if lk == "host" and not PRESERVE_HOST:
-            continue
-        # 移除 Content-Length，让 httpx 根据实际内容自动计算
-        # 因为我们可能会修改请求体，导致长度改变
-        if lk == "content-length":
-            continue
-        out[k] = v
-    return out
-
-
-def filter_response_headers(headers: Iterable[tuple]) -> dict:
+    # Starlette Headers：直接遍历 raw，键已是小写 bytes，无需中间列表和 lower()
+    if isinstance(headers, Headers):
+        return {
+            key: v.decode("latin-1") for k, v in headers.raw
+            if (key := k.decode("latin-1")) not in _REQ_EXCLUDE
+        }
+
+    # 其他来源的请求头大小写不定，需要 lower() 后再比对；已是小写的键直接复用
+    pairs = headers.items() if isinstance(headers, Mapping) else headers
+    return {
+        k: v for k, v in pairs
+        if (k if k.islower() else k.lower()) not in _REQ_EXCLUDE
+    }
+
+
+def filter_response_headers(headers: Iterable[tuple[str, str]]) -> dict[str, str]:
     """
     过滤响应头，移除 hop-by-hop 头部和 Content-Length
 
     Args:
-        headers: 原始响应头（可迭代的元组列表）
+        headers: 原始响应头（可迭代的元组列表，键需为小写，如 httpx 的 resp.headers.items()）
 
     Returns:
         dict: 过滤后的响应头字典
     """
-    out = {}
-    for k, v in headers:
-        lk = k.lower()
-        if lk in HOP_BY_HOP_HEADERS:
-            continue
-        # 移除 Content-Length，避免流式响应时长度不匹配
-        # StreamingResponse 会自动处理传输编码
-        if lk == "content-length":
-            continue
-        # httpx 会自动解压 gzip/deflate，去掉 Content-Encoding 避免客户端重复解压导致 ZlibError
-        if lk == "content-encoding":
-            continue
-        out[k] = v
+    # httpx 的 Headers.items() 已返回小写键，无需再 lower()；
+    # 需要剔除的头部很少，整体复制后逐个 pop 比逐项插入新字典更省
+    out = dict(headers)
+    for k in _RESP_EXCLUDE:
+        out.pop(k, None)
     return out
 
 
+def _is_top_level(body: bytes, pos: int) -> bool:
+    """
+    判断 pos 处的键是否位于顶层对象中
+
+    去掉字符串字面量后统计括号深度；只扫描 pos 前后较短的一侧
+    （对合法 JSON，前缀深度 = 后缀中闭括号数 - 开括号数）
+    """
+    if pos <= len(body) - pos:
+        structure = _JSON_STRING_RE.sub(b'', body[:pos])
+        depth = structure.count(b'{') + structure.count(b'[') - structure.count(b'}') - structure.count(b']')
+    else:
+        structure = _JSON_STRING_RE.sub(b'', body[pos:])
+        depth = structure.count(b'}') + structure.count(b']') - structure.count(b'{') - structure.count(b'[')
+    return depth == 1
+
+
+def _splice_first_system_text(body: bytes, replacement: bytes) -> bytes | None:
+    """
+    直接在原始字节上替换 system[0].text，避免整体解析和重新序列化
+
+    仅在 body 中 "system" 只出现一次且位于顶层、第一个元素是只含简单值的对象时生效，
+    其余情况返回 None，由调用方回退到完整的 JSON 处理
+
+    Args:
+        body: 原始请求体（bytes）
+        replacement: 替换文本的 JSON 字符串字面量（含引号）
+
+    Returns:
+        替换后的请求体（bytes），无法安全定位时返回 None
+    """
+    # 出现多次时无法仅凭字节判断哪个是顶层字段
+    start = body.find(b'"system"')
+    if start == -1 or body.find(b'"system"', start + 8) != -1:
+        return None
+
+    # 含转义的键可能解码后也是 "system"（重复键由解析器保留最后一个），无法仅凭字节判断
+    if _ESCAPED_LOWERCASE_RE.search(body):
+        return None
+
+    # 开头引号前有奇数个反斜杠说明引号被转义，匹配落在其他字符串内部
+    backslashes = 0
+    while start - backslashes > 0 and body[start - backslashes - 1] == 0x5C:
+        backslashes += 1
+    if backslashes % 2:
+        return None
+
+    match = _SYSTEM_ARRAY_RE.match(body, start)
+    if match is None or not _is_top_level(body, start):
+        return None
+
+    # 遍历第一个元素中的全部键值对，定位 text 的字符串字面量
+    pos = match.end()
+    text_span = None
+    while True:
+        key_match = _OBJECT_KEY_RE.match(body, pos)
+        if key_match is None:
+            return None
+        key = key_match.group(1)
+        # 含转义的键可能解码后等于 "text"，无法仅凭字节判断
+        if b'\\' in key:
+            return None
+        pos = key_match.end()
+
+        if key == b'"text"':
+            # 重复的 text 键：解析器保留最后一个，原地替换第一个会与完整解析结果不一致
+            if text_span is not None:
+                return None
+            value_match = _JSON_STRING_RE.match(body, pos)
+            if value_match is None:
+                return None
+            text_span = value_match.span()
+        else:
+            value_match = _JSON_STRING_RE.match(body, pos) or _FLAT_VALUE_RE.match(body, pos)
+            if value_match is None:
+                return None
+
+        sep_match = _OBJECT_SEP_RE.match(body, value_match.end())
+        if sep_match is None:
+            return None
+        if sep_match.group(1) == b'}':
+            break
+        pos = sep_match.end()
+
+    # 第一个元素没有 text 字段
+    if text_span is None:
+        return None
+
+    text_start, text_end = text_span
+    if body[text_start:text_end] == replacement:
+        return body
+    return body[:text_start] + replacement + body[text_end:]
+
+
 def process_request_body(body: bytes) -> bytes:
     """
     处理请求体,替换 system 数组中第一个元素的 text 内容
@@ -104,15 +241,42 @@ def process_request_body(body: bytes) -> bytes:
         #     print(f"[System Replacement None] Failed to parse or access system prompt: {e}")
         return body
 
-    # 尝试解析 JSON
+    # 字节级预过滤：不含 "system" 键的请求体无需解析和重新序列化
+    if b'"system"' not in body:
+        if LOG_SYSTEM_REPLACEMENT:
+            logger.debug("[System Replacement] No 'system' key in raw body, keeping original body")
+        return body
+
+    # 原始模式下优先在字节层面原地替换，只有无法安全定位时才完整解析
+    if not SYSTEM_PROMPT_BLOCK_INSERT_IF_NOT_EXIST and _REPLACEMENT_JSON is not None:
+        spliced = _splice_first_system_text(body, _REPLACEMENT_JSON)
+        if spliced is not None:
+            if LOG_SYSTEM_REPLACEMENT:
+                logger.debug(
+                    "[System Replacement] Spliced system[0].text in place (original size: %s bytes, new size: %s bytes)",
+                    len(body),
+                    len(spliced),
+                )
+            return spliced
+
+    # 尝试解析 JSON（orjson 直接接受 bytes，省去一次 decode）
+    parsed_by_stdlib = False
     try:
-        data = json.loads(body.decode('utf-8'))
+        data = orjson.loads(body)
         if LOG_SYSTEM_REPLACEMENT:
             logger.debug("[System Replacement] Successfully parsed JSON body")
-    except (json.JSONDecodeError, UnicodeDecodeError) as e:
-        if LOG_SYSTEM_REPLACEMENT:
-            logger.debug("[System Replacement] Failed to parse JSON: %s, keeping original body", e)
-        return body
+    except orjson.JSONDecodeError as e:
+        # orjson 比标准库严格：孤立的代理项转义（如截断的 emoji "\ud83d"）、1e400、NaN 会被拒绝，
+        # 回退到标准库 json 再解析一次
+        try:
+            data = json.loads(body.decode('utf-8'))
+            parsed_by_stdlib = True
+            if LOG_SYSTEM_REPLACEMENT:
+                logger.debug("[System Replacement] orjson rejected body (%s), parsed with json instead", e)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            if LOG_SYSTEM_REPLACEMENT:
+                logger.debug("[System Replacement] Failed to parse JSON: %s, keeping original body", e)
+            return body
 
     # 检查 system 字段是否存在且为列表
     if "system" not in data:
@@ -151,7 +315,7 @@ def process_request_body(body: bytes) -> bytes:
     # 判断是否启用插入模式
     if SYSTEM_PROMPT_BLOCK_INSERT_IF_NOT_EXIST:
         # 插入模式：检查是否包含关键字（忽略大小写）
-        if CLAUDE_CODE_KEYWORD.lower() in original_text.lower():
+        if _CLAUDE_CODE_KEYWORD_RE.search(original_text) is not None:
             # 包含关键字：执行替换
             first_element["text"] = SYSTEM_PROMPT_REPLACEMENT
             if LOG_SYSTEM_REPLACEMENT:
@@ -173,6 +337,11 @@ def process_request_body(body: bytes) -> bytes:
                 logger.debug("[System Replacement] Array length changed: %s -> %s", len(data["system"]) - 1, len(data["system"]))
     else:
         # 原始模式：直接替换
+        if original_text == SYSTEM_PROMPT_REPLACEMENT:
+            # 替换前后内容一致，跳过重新序列化
+            if LOG_SYSTEM_REPLACEMENT:
+                logger.debug("[System Replacement] Text already matches replacement, keeping original body")
+            return body
         first_element["text"] = SYSTEM_PROMPT_REPLACEMENT
         if LOG_SYSTEM_REPLACEMENT:
             preview = SYSTEM_PROMPT_REPLACEMENT[:100] + ("..." if len(SYSTEM_PROMPT_REPLACEMENT) > 100 else "")
@@ -186,8 +355,16 @@ def process_request_body(body: bytes) -> bytes:
 
     # 转换回 JSON bytes
     try:
-        # 这里必须加 separators 压缩空格，我也不知道为什么有空格不行。。。
-        modified_body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        if parsed_by_stdlib:
+            # 标准库解析的结果可能含 orjson 无法序列化的值，沿用 json 序列化（必须加 separators 压缩空格）
+            try:
+                modified_body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            except UnicodeEncodeError:
+                # 孤立的代理项无法编码为 UTF-8，改用 \uXXXX 转义输出（与原始请求中的写法一致）
+                modified_body = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        else:
+            # orjson 直接输出紧凑的 UTF-8 bytes（无空格），无需额外指定 separators
+            modified_body = orjson.dumps(data)
         if LOG_SYSTEM_REPLACEMENT:
             logger.debug(
                 "[System Replacement] Successfully modified body (original size: %s bytes, new size: %s bytes)",
@@ -201,12 +378,17 @@ def process_request_body(body: bytes) -> bytes:
         return body
 
 
-def prepare_forward_headers(incoming_headers: Iterable[tuple], client_host: str = None, target_url: str = None, api_key: str = None) -> dict:
+def prepare_forward_headers(
+    incoming_headers: Headers | Mapping[str, str] | Iterable[tuple[str, str]],
+    client_host: str | None = None,
+    target_url: str | None = None,
+    api_key: str | None = None,
+) -> dict[str, str]:
     """
     准备转发的请求头
 
     Args:
-        incoming_headers: 原始请求头
+        incoming_headers: 原始请求头（Starlette Headers、普通映射，或可迭代的 (key, value) 元组）
         client_host: 客户端 IP 地址
         target_url: 目标 URL（用于设置 Host）
         api_key: API Key（用于认证）
@@ -220,26 +402,19 @@ def prepare_forward_headers(incoming_headers: Iterable[tuple], client_host: str
     # 设置 Host
     if not PRESERVE_HOST:
         # 优先使用动态目标 URL，否则使用配置的 TARGET_BASE_URL
-        base_url = target_url if target_url else TARGET_BASE_URL
-        parsed = urlparse(base_url)
-        forward_headers["Host"] = parsed.netloc
+        if not target_url or target_url == TARGET_BASE_URL:
+            forward_headers["Host"] = _TARGET_NETLOC
+        else:
+            forward_headers["Host"] = _netloc_for(target_url)
 
     # 注入 API Key（如果提供）
     if api_key:
         # 检查 API Key 格式，决定使用哪个头部
-        if api_key.startswith("sk-ant-"):
-            # Anthropic API Key
-            forward_headers["x-api-key"] = api_key
-        elif api_key.startswith("Bearer "):
-            # Bearer Token
-            forward_headers["authorization"] = api_key
-        else:
-            # 默认当作 x-api-key
-            forward_headers["x-api-key"] = api_key
+        name, value = _auth_header_for(api_key)
+        forward_headers[name] = value
 
     # 注入自定义 Header
-    for k, v in CUSTOM_HEADERS.items():
-        forward_headers[k] = v
+    forward_headers.update(CUSTOM_HEADERS)
 
     # 添加 X-Forwarded-For
     if client_host:
@@ -45,18 +45,32 @@ time_window_stats = {
 }
 
 
-async def record_request_start(path: str, method: str, bytes_sent: int) -> str:
-    """记录请求开始，返回请求ID，并立即添加到 recent_requests"""
+# 待处理的请求开始事件：请求路径上只做同步 append，不等待 stats_lock，
+# 由下一个持锁的统计操作（记录完成、读取统计、定时任务）批量写入统计数据。
+# 不设上限：丢弃开始事件会让请求计数与完成记录对不上，而每次完成记录都会清空该队列
+_pending_starts: deque[tuple[str, str, str, int, float]] = deque()
+
+
+def emit_request_start(path: str, method: str, bytes_sent: int | None) -> str:
+    """登记请求开始（同步、无锁），返回请求ID
+
+    bytes_sent 为 None 表示请求体以流式转发、长度未知，按 0 计入统计
+    """
     request_id = f"{int(time.time() * 1000)}-{id(asyncio.current_task())}"
-    current_time = time.time()
+    _pending_starts.append((request_id, path, method, bytes_sent or 0, time.time()))
+    return request_id
 
-    async with stats_lock:
+
+def _drain_pending_starts():
+    """将待处理的请求开始事件写入统计数据（调用方需持有 stats_lock）"""
+    while _pending_starts:
+        request_id, path, method, bytes_sent, timestamp = _pending_starts.popleft()
         request_stats["total_requests"] += 1
         request_stats["total_bytes_sent"] += bytes_sent
         path_stats[path]["count"] += 1
         path_stats[path]["bytes"] += bytes_sent
 
-        # 立即添加到 recent_requests（状态为 pending）
+        # 添加到 recent_requests（状态为 pending）
         recent_requests.append({
             "request_id": request_id,
             "path": path,
@@ -65,11 +79,9 @@ async def record_request_start(path: str, method: str, bytes_sent: int) -> str:
             "status_code": None,  # 尚未完成，无状态码
             "bytes": 0,
             "response_time": 0,
-            "timestamp": current_time
+            "timestamp": timestamp
         })
 
-    return request_id
-
 
 async def record_request_success(
     request_id: str,
@@ -81,6 +93,7 @@ async def record_request_success(
 ):
     """记录成功请求，更新已存在的记录"""
     async with stats_lock:
+        _drain_pending_starts()
         existing_req = None
         for req in reversed(recent_requests):
             if req["request_id"] == request_id:
@@ -97,7 +110,8 @@ async def record_request_success(
         # 更新路径统计
         current_avg = path_stats[path]["avg_response_time"]
         count = path_stats[path]["count"]
-        path_stats[path]["avg_response_time"] = (current_avg * (count - 1) + response_time) / count
+        if count > 0:
+            path_stats[path]["avg_response_time"] = (current_avg * (count - 1) + response_time) / count
 
         # 查找并更新 recent_requests 中的记录
         found = False
@@ -128,11 +142,12 @@ async def record_request_error(
     method: str,
     error_msg: str,
     response_time: float = 0,
-    response_content: str = None,
+    response_content: str | None = None,
     status_code: int | None = None
 ):
     """记录请求错误，更新已存在的记录"""
     async with stats_lock:
+        _drain_pending_starts()
         existing_req = None
         for req in reversed(recent_requests):
             if req["request_id"] == request_id:
@@ -189,6 +204,8 @@ async def update_time_window_stats():
     current_minute_timestamp = int(current_time // 60) * 60
 
     async with stats_lock:
+        _drain_pending_starts()
+
         # 计算本分钟的请求数
         minute_requests = sum(1 for req in recent_requests
                             if req["timestamp"] > current_time - 60)
@@ -258,6 +275,8 @@ async def get_time_filtered_data(start_time: float = None, end_time: float = Non
         end_time = current_time
 
     async with stats_lock:
+        _drain_pending_starts()
+
         # 过滤最近的请求
         filtered_requests = [
             req for req in recent_requests
@@ -301,6 +320,8 @@ async def cleanup_stale_requests():
             stale_requests = []  # 收集超时请求，统一记录错误
 
             async with stats_lock:
+                _drain_pending_starts()
+
                 # 遍历并标记超时的 pending 请求
                 for req in list(recent_requests):
                     if req.get("status") == "pending":
@@ -1,10 +1,26 @@
 """
 编码处理工具模块
 
-提供文本编码转换和长度限制功能
+提供文本编码转换、内容解压和长度限制功能
 """
 
 import codecs
+import io
+import zlib
+
+# brotli / zstd 为可选依赖，与 httpx 的解码器保持一致：已安装时才能解压
+try:
+    import brotli  # type: ignore[import-not-found]
+except ImportError:
+    try:
+        import brotlicffi as brotli  # type: ignore[import-not-found]
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard  # type: ignore[import-not-found]
+except ImportError:
+    zstandard = None
 
 
 def ensure_unicode(text, max_length=50*1024):
@@ -43,3 +59,80 @@ def ensure_unicode(text, max_length=50*1024):
             decoded = f"[响应内容长度 {len(decoded)} 超过限制 {max_length}]"
 
     return decoded
+
+
+def decompress_body(content, content_encoding=None, max_length=50*1024):
+    """
+    按 Content-Encoding 解压响应体（容忍被截断的压缩流）
+
+    参数:
+        content: 原始响应字节串（可能只是压缩流的前一部分）
+        content_encoding: 响应头中的 Content-Encoding 值
+        max_length: 解压输出的最大字节数（默认 50KB），防止高压缩比数据膨胀占满内存
+
+    返回:
+        解压后的字节串（最多 max_length 字节）；未压缩、不支持的编码或解压失败时原样返回；
+        br/zstd 解码器未安装时返回占位说明，避免压缩数据被当作文本记录成乱码
+    """
+    if not content or not content_encoding:
+        return content
+
+    encoding = content_encoding.strip().lower()
+    if encoding == 'br':
+        return _decompress_brotli(content, max_length)
+    if encoding == 'zstd':
+        return _decompress_zstd(content, max_length)
+    if encoding == 'gzip':
+        wbits_candidates = (16 + zlib.MAX_WBITS,)
+    elif encoding == 'deflate':
+        # deflate 既可能带 zlib 头，也可能是裸流
+        wbits_candidates = (zlib.MAX_WBITS, -zlib.MAX_WBITS)
+    else:
+        return content
+
+    for wbits in wbits_candidates:
+        try:
+            # 使用 decompressobj 而非 zlib.decompress，以便处理被截断的数据并限制输出长度
+            return zlib.decompressobj(wbits).decompress(content, max_length)
+        except zlib.error:
+            continue
+    return content
+
+
+# brotli 不支持 output_buffer_limit 时（brotlicffi、旧版 brotli）每次送入的压缩数据长度，
+# 限制单次调用可能膨胀出的输出
+_BROTLI_INPUT_CHUNK = 64
+
+
+def _decompress_brotli(content, max_length):
+    """解压 brotli 数据（输出最多 max_length 字节；解压失败时原样返回）"""
+    if brotli is None:
+        return b'[br-encoded body, decoder not installed]'
+    decompressor = brotli.Decompressor()
+    # brotlicffi 提供 decompress，brotli 提供 process；两者都会尽量输出已解出的数据
+    process = getattr(decompressor, 'decompress', None) or decompressor.process
+    try:
+        try:
+            return process(content, output_buffer_limit=max_length)[:max_length]
+        except TypeError:
+            # 不支持 output_buffer_limit（brotlicffi、brotli < 1.2）：分块送入，达到上限即停止
+            pass
+
+        output = bytearray()
+        for start in range(0, len(content), _BROTLI_INPUT_CHUNK):
+            output += process(content[start:start + _BROTLI_INPUT_CHUNK])
+            if len(output) >= max_length:
+                break
+        return bytes(output[:max_length])
+    except brotli.error:
+        return content
+
+
+def _decompress_zstd(content, max_length):
+    """解压 zstd 数据（输出最多 max_length 字节；解压失败时原样返回）"""
+    if zstandard is None:
+        return b'[zstd-encoded body, decoder not installed]'
+    try:
+        return zstandard.ZstdDecompressor().stream_reader(io.BytesIO(content)).read(max_length)
+    except zstandard.ZstdError:
+        return content
@@ -5,11 +5,14 @@
 
 import sys
 import os
+import gzip
+import zlib
 
 # 将 backend 目录添加到路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from backend.utils.encoding import ensure_unicode
+from backend.utils import encoding
+from backend.utils.encoding import decompress_body, ensure_unicode
 
 def test_encoding_conversion():
     """测试编码转换功能"""
@@ -72,8 +75,83 @@ def test_encoding_conversion():
     print("=" * 60)
     return 0
 
+def test_decompress_body():
+    """测试按 Content-Encoding 解压响应体"""
+    print("=" * 60)
+    print("测试 decompress_body...")
+    print("=" * 60)
+
+    original = '{"error": {"message": "当前模型无法访问"}}'.encode('utf-8') * 20
+
+    # 测试 1: gzip
+    print("\n测试 1: gzip")
+    result = decompress_body(gzip.compress(original), 'gzip')
+    print(f"✓ 解压后长度: {len(result)}")
+    assert result == original
+
+    # 测试 2: deflate（zlib 头与裸流）
+    print("\n测试 2: deflate")
+    raw_deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    raw_stream = raw_deflate.compress(original) + raw_deflate.flush()
+    assert decompress_body(zlib.compress(original), 'deflate') == original
+    assert decompress_body(raw_stream, ' Deflate ') == original
+    print("✓ zlib 头与裸流均可解压")
+
+    # 测试 3: 被截断的 gzip 流（错误响应只缓冲了前一部分）
+    print("\n测试 3: 截断的 gzip 流")
+    compressed = gzip.compress(original, compresslevel=1)
+    result = decompress_body(compressed[:len(compressed) // 2], 'gzip')
+    print(f"✓ 解压出 {len(result)} 字节前缀")
+    assert result and original.startswith(result)
+
+    # 测试 4: 未压缩、未知编码、损坏的数据原样返回
+    print("\n测试 4: 原样返回")
+    assert decompress_body(original, None) is original
+    assert decompress_body(original, 'identity') is original
+    assert decompress_body(b'not gzip', 'gzip') == b'not gzip'
+    assert decompress_body(b'', 'gzip') == b''
+    print("✓ 无需或无法解压时保持原样")
+
+    # 测试 5: br / zstd（仅在安装了对应可选依赖时）
+    print("\n测试 5: br / zstd")
+    if encoding.brotli is not None:
+        assert decompress_body(encoding.brotli.compress(original), 'br') == original
+        print("✓ br 解压成功")
+    else:
+        assert decompress_body(b'\x0b\x00\x80', 'br') == b'[br-encoded body, decoder not installed]'
+        print("  未安装 brotli，返回占位说明")
+    if encoding.zstandard is not None:
+        compressed = encoding.zstandard.ZstdCompressor().compress(original)
+        assert decompress_body(compressed, 'zstd') == original
+        print("✓ zstd 解压成功")
+    else:
+        assert decompress_body(b'\x28\xb5\x2f\xfd', 'zstd') == b'[zstd-encoded body, decoder not installed]'
+        print("  未安装 zstandard，返回占位说明")
+
+    # 测试 6: 高压缩比数据，解压输出不得超过上限
+    print("\n测试 6: 高压缩比数据（解压输出上限）")
+    bomb = gzip.compress(bytes(50 * 1024 * 1024))
+    result = decompress_body(bomb[:50 * 1024], 'gzip')
+    print(f"✓ 压缩 {len(bomb)} 字节，解压输出 {len(result)} 字节")
+    assert len(result) <= 50 * 1024
+    assert len(decompress_body(zlib.compress(bytes(10 * 1024 * 1024)), 'deflate', max_length=1000)) == 1000
+    if encoding.brotli is not None:
+        result = decompress_body(encoding.brotli.compress(bytes(10 * 1024 * 1024)), 'br')
+        assert len(result) == 50 * 1024
+        print(f"✓ br 解压输出 {len(result)} 字节")
+    if encoding.zstandard is not None:
+        result = decompress_body(encoding.zstandard.ZstdCompressor().compress(bytes(10 * 1024 * 1024)), 'zstd')
+        assert len(result) == 50 * 1024
+        print(f"✓ zstd 解压输出 {len(result)} 字节")
+
+    print("\n" + "=" * 60)
+    print("✓ 所有 decompress_body 测试通过！")
+    print("=" * 60)
+    return 0
+
 if __name__ == "__main__":
     try:
+        test_decompress_body()
         sys.exit(test_encoding_conversion())
     except Exception as e:
         print(f"\n✗ 测试失败: {e}")
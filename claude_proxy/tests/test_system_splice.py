@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+测试 system[0].text 原地替换（字节层面）与完整 JSON 解析路径的一致性
+"""
+
+import contextlib
+import json
+import os
+import random
+import string
+import sys
+
+import orjson
+
+# 将 claude_proxy 目录添加到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.services import proxy
+
+REPLACEMENT = '替换 "q" \\ \n\t end'
+
+
+@contextlib.contextmanager
+def _configured(insert=False):
+    """临时设置替换文本和插入模式（不依赖外部环境变量），退出时恢复模块原有配置"""
+    saved = (proxy.SYSTEM_PROMPT_REPLACEMENT, proxy.SYSTEM_PROMPT_BLOCK_INSERT_IF_NOT_EXIST, proxy._REPLACEMENT_JSON)
+    proxy.SYSTEM_PROMPT_REPLACEMENT = REPLACEMENT
+    proxy.SYSTEM_PROMPT_BLOCK_INSERT_IF_NOT_EXIST = insert
+    proxy._REPLACEMENT_JSON = orjson.dumps(REPLACEMENT)
+    try:
+        yield
+    finally:
+        proxy.SYSTEM_PROMPT_REPLACEMENT, proxy.SYSTEM_PROMPT_BLOCK_INSERT_IF_NOT_EXIST, proxy._REPLACEMENT_JSON = saved
+
+
+def _full_parse(body):
+    """关闭原地替换，走完整的 JSON 解析路径"""
+    splice = proxy._splice_first_system_text
+    proxy._splice_first_system_text = lambda *args: None
+    try:
+        return proxy.process_request_body(body)
+    finally:
+        proxy._splice_first_system_text = splice
+
+
+def _assert_equivalent(body):
+    """原地替换与完整解析的结果必须语义一致；返回是否走了原地替换"""
+    spliced = proxy._splice_first_system_text(body, proxy._REPLACEMENT_JSON)
+    expected = _full_parse(body)
+    actual = proxy.process_request_body(body)
+
+    if expected is body:
+        assert actual is body or orjson.loads(actual) == orjson.loads(body), (body, actual)
+    else:
+        assert orjson.loads(actual) == orjson.loads(expected), (body, actual, expected)
+    return spliced is not None
+
+
+def test_splice_replaces_first_text():
+    """常规请求体：原地替换并保持其余内容不变"""
+    with _configured():
+        body = json.dumps({
+            "model": "claude",
+            "messages": [{"role": "user", "content": "你好"}],
+            "system": [
+                {"type": "text", "text": "You are Claude Code", "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": "second"},
+            ],
+        }, ensure_ascii=False).encode('utf-8')
+
+        spliced = proxy._splice_first_system_text(body, proxy._REPLACEMENT_JSON)
+        assert spliced is not None
+        data = orjson.loads(spliced)
+        assert data["system"][0]["text"] == REPLACEMENT
+        assert data["system"][1]["text"] == "second"
+        assert _assert_equivalent(body)
+
+        # 替换后再次处理：内容一致，直接返回原始 body
+        assert proxy.process_request_body(spliced) is spliced
+
+
+def test_splice_falls_back_on_ambiguous_bodies():
+    """无法仅凭字节安全定位的情况必须回退到完整解析"""
+    with _configured():
+        cases = [
+            # "system" 出现在被转义的引号之后（属于另一个键）
+            rb'{"x\"system":[{"text":"a"}]}',
+            # 重复的 text 键：解析器保留最后一个
+            b'{"system":[{"text":"a","text":"b"}]}',
+            # 含转义的键解码后等于 text
+            rb'{"system":[{"text":"a","t\u0065xt":"b"}]}',
+            # 含转义的重复 system 键：解析器保留最后一个
+            rb'{"system":[{"text":"a"}],"\u0073ystem":[{"text":"b"}]}',
+            rb'{"sys\u0074em":[{"text":"b"}],"system":[{"text":"a"}]}',
+            # 只有嵌套在消息中的 system，没有顶层 system
+            b'{"messages":[{"role":"user","content":[{"type":"tool_use","input":{"system":[{"text":"nested"}]}}]}]}',
+            # 顶层 system 之外还有嵌套的 system
+            b'{"messages":[{"content":{"system":[{"text":"n"}]}}],"system":[{"text":"a"}]}',
+            # text 不是字符串
+            b'{"system":[{"type":"text","text":1}]}',
+            b'{"system":[{"type":"text","text":null}]}',
+            b'{"system":[{"type":"text","text":["x"]}]}',
+            # 第一个元素没有 text，第二个元素有
+            b'{"system":[{"type":"text"},{"type":"text","text":"b"}]}',
+            # 第一个元素包含嵌套数组
+            b'{"system":[{"tags":[1,2],"text":"a"}]}',
+            # system 不是数组
+            b'{"system":"plain"}',
+            b'{"system":[]}',
+        ]
+        for body in cases:
+            assert proxy._splice_first_system_text(body, proxy._REPLACEMENT_JSON) is None, body
+            _assert_equivalent(body)
+
+
+def test_stdlib_fallback_for_orjson_rejected_bodies():
+    """orjson 拒绝但标准库 json 可解析的请求体（孤立代理项、1e400、NaN）仍需替换"""
+    with _configured(insert=True):
+        cases = [
+            rb'{"system":[{"type":"text","text":"You are Claude Code"}],"m":"\ud83d"}',
+            b'{"system":[{"type":"text","text":"You are Claude Code"}],"n":1e400}',
+            b'{"system":[{"type":"text","text":"You are Claude Code"}],"n":NaN}',
+        ]
+        for body in cases:
+            result = proxy.process_request_body(body)
+            assert result is not body, body
+            data = json.loads(result)
+            assert data["system"][0]["text"] == REPLACEMENT
+            assert len(data["system"]) == 1
+
+        # 两种解析器都无法解析时保持原样
+        invalid = b'{"system":[{"text":"You are Claude Code"}]'
+        assert proxy.process_request_body(invalid) is invalid
+
+
+def _random_text(length):
+    return ''.join(random.choices(string.ascii_letters + ' "\\\n\t中文{}[]:,/', k=length))
+
+
+def test_splice_randomized_equivalence():
+    """随机请求体：原地替换与完整解析结果一致"""
+    with _configured():
+        rng_state = random.getstate()
+        random.seed(20251015)
+        spliced_count = 0
+        try:
+            for _ in range(3000):
+                first = {}
+                for key in random.sample(['type', 'text', 'cache_control', 'n', 'flag'], k=random.randint(0, 5)):
+                    first[key] = {
+                        'type': _random_text(3),
+                        'text': _random_text(random.randint(0, 50)),
+                        'cache_control': {'type': 'ephemeral'},
+                        'n': random.choice([1, -2.5e3, None, True]),
+                        'flag': [1, 2] if random.random() < 0.2 else False,
+                    }[key]
+                if random.random() < 0.1:
+                    first['text'] = random.choice([1, None, ['x']])
+
+                data = {'model': 'm', 'messages': [{'role': random.choice(['user', 'system']), 'content': _random_text(30)}]}
+                if random.random() < 0.1:
+                    data['messages'].append({'role': 'user', 'content': [
+                        {'type': 'tool_use', 'input': {'system': [{'text': 'nested'}]}}
+                    ]})
+                if random.random() < 0.9:
+                    data['system'] = [first] + [{'type': 'text', 'text': _random_text(5)}] * random.randint(0, 2)
+                if random.random() < 0.05:
+                    data['system'] = _random_text(5)
+
+                items = list(data.items())
+                random.shuffle(items)
+                body = json.dumps(
+                    dict(items),
+                    ensure_ascii=random.random() < 0.5,
+                    indent=random.choice([None, 1]),
+                ).encode('utf-8')
+
+                if _assert_equivalent(body):
+                    spliced_count += 1
+        finally:
+            random.setstate(rng_state)
+
+        # 确保随机用例确实覆盖到了原地替换路径
+        assert spliced_count > 0
+
+
+if __name__ == "__main__":
+    for test in (
+        test_splice_replaces_first_text,
+        test_splice_falls_back_on_ambiguous_bodies,
+        test_stdlib_fallback_for_orjson_rejected_bodies,
+        test_splice_randomized_equivalence,
+    ):
+        test()
+        print(f"✓ {test.__name__}")
+    print("✓ 所有 system 原地替换测试通过！")